@@ -1,10 +1,22 @@
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib.ticker as ticker
+import numpy as np
 import math
 import calendar
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional; _amortize_loop then runs as plain Python
+    njit = None
+
+SCHEDULE_COLUMNS = [
+    "Year", "MonthNum", "MonthAbbr", "OldBalance", "InterestPaid",
+    "PrincipalPaid", "Prepayment", "NewBalance",
+]
+
+# Jan..Dec as an ordered categorical, so MonthAbbr is stored as small codes
+MONTH_ABBR_DTYPE = pd.CategoricalDtype(categories=list(calendar.month_abbr[1:13]), ordered=True)
+
 ############################
 # Utility Functions
 ############################
@@ -13,10 +25,15 @@ def format_inr(amount):
     """Format a number as Indian Rupees with commas and no decimals."""
     return f"₹ {amount:,.0f}"
 
+def format_inr_array(amounts):
+    """Format an array of numbers as Indian Rupees in a single pass."""
+    return [format_inr(amount) for amount in np.asarray(amounts, dtype=float).tolist()]
+
 ############################
 # Monthly EMI Calculation
 ############################
 
+@st.cache_data(max_entries=128)
 def calculate_car_emi(
     principal,
     annual_interest_rate,
@@ -34,26 +51,80 @@ def calculate_car_emi(
     monthly_interest_rate = (annual_interest_rate / 100.0) / 12.0
     total_months = loan_tenure_years * 12
 
+    return _emi(principal, monthly_interest_rate, total_months,
+                (1 + monthly_interest_rate) ** total_months)
+
+
+def _emi(principal, monthly_interest_rate, total_months, growth):
+    """
+    EMI from the compounding factor growth = (1+r)^n, so the schedule can
+    pass in the last of the (1+r)^k powers it already computed.
+    """
     if total_months <= 0:
         return 0.0
     if monthly_interest_rate == 0:
         # Edge case: 0% interest
         return principal / total_months
 
-    emi = (
-        principal
-        * monthly_interest_rate
-        * (1 + monthly_interest_rate) ** total_months
-    ) / (
-        (1 + monthly_interest_rate) ** total_months - 1
-    )
-    return emi
+    return float(principal * monthly_interest_rate * growth / (growth - 1))
 
 
 ############################
 # Monthly Amortization Schedule
 ############################
 
+def _amortize(principal, r, emi, growth):
+    """
+    Month-by-month balances for a schedule without prepayments, before it is
+    cut off at payoff. growth holds (1+r)^k for k = 0..n.
+    Returns (old_balance, interest, principal_paid, new_balance) arrays.
+    """
+    n = len(growth) - 1
+    # The whole schedule is a single annuity, so
+    # b_k = P(1+r)^k - emi((1+r)^k - 1)/r for every month at once
+    if r == 0:
+        new_balance = principal - emi * np.arange(1, n + 1)
+    else:
+        new_balance = principal * growth[1:] - emi * (growth[1:] - 1) / r
+
+    old_balance = np.empty(n)
+    old_balance[0] = principal
+    old_balance[1:] = new_balance[:-1]
+    interest_payment = old_balance * r
+    principal_payment = emi - interest_payment
+
+    return old_balance, interest_payment, principal_payment, new_balance
+
+
+def _amortize_loop(principal, r, emi, prepay_amount):
+    """
+    Month-by-month balances for a schedule with prepayments, which the
+    closed form in _amortize cannot express. Compiled by numba when available.
+    """
+    n = len(prepay_amount)
+    old_balance = np.empty(n, dtype=np.float64)
+    interest_payment = np.empty(n, dtype=np.float64)
+    principal_payment = np.empty(n, dtype=np.float64)
+    new_balance = np.empty(n, dtype=np.float64)
+
+    balance = principal
+    for i in range(n):
+        interest = balance * r
+
+        old_balance[i] = balance
+        interest_payment[i] = interest
+        principal_payment[i] = emi - interest
+        balance = balance - (emi - interest) - prepay_amount[i]
+        new_balance[i] = balance
+
+    return old_balance, interest_payment, principal_payment, new_balance
+
+
+if njit is not None:
+    _amortize_loop = njit(cache=True)(_amortize_loop)
+
+
+@st.cache_data(max_entries=128)
 def build_monthly_schedule(
     principal,
     annual_interest_rate,
@@ -73,55 +144,45 @@ def build_monthly_schedule(
     monthly_interest_rate = (annual_interest_rate / 100.0) / 12.0
     total_months = loan_tenure_years * 12
 
-    # Basic EMI
-    emi = calculate_car_emi(principal, annual_interest_rate, loan_tenure_years)
+    if principal <= 0 or total_months <= 0:
+        return pd.DataFrame(columns=SCHEDULE_COLUMNS)
 
-    balance = principal
-    data_rows = []
-    current_month = 1
-
-    while balance > 0 and current_month <= total_months:
-        # Determine the calendar year and month (for display)
-        year_offset = (current_month - 1) // 12
-        this_year = start_year + year_offset
-        month_index = (current_month - 1) % 12  # 0..11
-        month_abbr = calendar.month_abbr[month_index + 1]
-
-        # Interest portion
-        interest_payment = balance * monthly_interest_rate
-        principal_payment = emi - interest_payment
-
-        # Prepayment
-        prepay_amount = 0.0
-        if monthly_prepayment > 0:
-            prepay_amount += monthly_prepayment
-        if (current_month % 3 == 0) and (quarterly_prepayment > 0):
-            prepay_amount += quarterly_prepayment
-
-        old_balance = balance
-        # Deduct principal portion
-        balance -= principal_payment
-        # Deduct prepayment
-        balance -= prepay_amount
-
-        if balance < 0:
-            balance = 0
-
-        data_rows.append({
-            "Year": this_year,
-            "MonthNum": current_month,
-            "MonthAbbr": month_abbr,
-            "OldBalance": old_balance,
-            "InterestPaid": interest_payment,
-            "PrincipalPaid": principal_payment,
-            "Prepayment": prepay_amount,
-            "NewBalance": balance,
-        })
+    # Monthly prepayment every month, plus the quarterly one every third month
+    months = np.arange(1, total_months + 1)
+    prepay_amount = np.full(total_months, float(monthly_prepayment))
+    prepay_amount[months % 3 == 0] += quarterly_prepayment
 
-        current_month += 1
+    if prepay_amount.any():
+        emi = _emi(principal, monthly_interest_rate, total_months,
+                   (1 + monthly_interest_rate) ** total_months)
+        old_balance, interest_payment, principal_payment, new_balance = _amortize_loop(
+            float(principal), monthly_interest_rate, emi, prepay_amount
+        )
+    else:
+        # The EMI and the closed-form balances share the same (1+r)^k powers
+        growth = (1 + monthly_interest_rate) ** np.arange(total_months + 1)
+        emi = _emi(principal, monthly_interest_rate, total_months, growth[-1])
+        old_balance, interest_payment, principal_payment, new_balance = _amortize(
+            float(principal), monthly_interest_rate, emi, growth
+        )
+
+    # The loan is closed in the first month the balance reaches zero
+    paid_off = np.flatnonzero(new_balance <= 0)
+    n = paid_off[0] + 1 if paid_off.size else total_months
+    new_balance[n - 1] = max(new_balance[n - 1], 0.0)
+    months = months[:n]
+
+    df_monthly = pd.DataFrame({
+        "Year": (start_year + (months - 1) // 12).astype(np.int16),
+        "MonthNum": months,
+        "MonthAbbr": pd.Categorical.from_codes((months - 1) % 12, dtype=MONTH_ABBR_DTYPE),
+        "OldBalance": old_balance[:n],
+        "InterestPaid": interest_payment[:n],
+        "PrincipalPaid": principal_payment[:n],
+        "Prepayment": prepay_amount[:n],
+        "NewBalance": new_balance[:n],
+    })
 
-    # Return as a DataFrame
-    df_monthly = pd.DataFrame(data_rows)
     return df_monthly
 
 
@@ -129,6 +190,7 @@ def build_monthly_schedule(
 # Yearly Aggregation
 ############################
 
+@st.cache_data(max_entries=128)
 def aggregate_yearly(df_monthly, start_year, loan_tenure_years):
     """
     Given the monthly schedule, produce a yearly summary.
@@ -138,36 +200,57 @@ def aggregate_yearly(df_monthly, start_year, loan_tenure_years):
     # Group by Year
     if df_monthly.empty:
         # No data
-        import numpy as np
-        df_yearly = pd.DataFrame(columns=["Year","PrincipalSum","PrepaymentSum","InterestSum","FinalBalance"])
+        df_yearly = pd.DataFrame(columns=["PrincipalSum","PrepaymentSum","InterestSum","FinalBalance"], dtype=float)
     else:
-        def aggregator(x):
-            return pd.Series({
-                "PrincipalSum": x["PrincipalPaid"].sum(),
-                "PrepaymentSum": x["Prepayment"].sum(),
-                "InterestSum": x["InterestPaid"].sum(),
-                "FinalBalance": x["NewBalance"].iloc[-1]
-            })
-
-        # Convert to int if needed
-        df_monthly["Year"] = df_monthly["Year"].astype(int)
-        df_yearly = df_monthly.groupby("Year").apply(aggregator).reset_index()
-
-    # Merge with all possible years (in case the loan ends early)
-    all_years = list(range(start_year, start_year + loan_tenure_years))
-    df_all_years = pd.DataFrame({"Year": all_years})
-    df_yearly = pd.merge(df_all_years, df_yearly, on="Year", how="left").fillna(0)
-    df_yearly.sort_values("Year", inplace=True)
+        df_yearly = df_monthly.groupby("Year", sort=True).agg(
+            PrincipalSum=("PrincipalPaid", "sum"),
+            PrepaymentSum=("Prepayment", "sum"),
+            InterestSum=("InterestPaid", "sum"),
+            FinalBalance=("NewBalance", "last"),
+        )
+
+    # Fill in all possible years (in case the loan ends early)
+    all_years = range(start_year, start_year + loan_tenure_years)
+    df_yearly = df_yearly.reindex(all_years, fill_value=0).rename_axis("Year").reset_index()
 
     # totalPayment = PrincipalSum + InterestSum + PrepaymentSum
-    df_yearly["TotalPayment"] = df_yearly["PrincipalSum"] + df_yearly["InterestSum"] + df_yearly["PrepaymentSum"]
+    df_yearly["TotalPayment"] = (
+        df_yearly["PrincipalSum"].to_numpy()
+        + df_yearly["InterestSum"].to_numpy()
+        + df_yearly["PrepaymentSum"].to_numpy()
+    )
     # FinalBalance for each year is in "FinalBalance"
     # If it's negative, clamp to 0
-    df_yearly["FinalBalance"] = df_yearly["FinalBalance"].apply(lambda x: max(0, x))
+    df_yearly["FinalBalance"] = df_yearly["FinalBalance"].clip(lower=0)
 
     return df_yearly
 
 
+############################
+# Charts
+############################
+
+def build_payment_pie_chart(total_principal, total_prepayment, total_interest):
+    """
+    Pie chart of the overall split between principal, prepayments and interest.
+    """
+    # Imported here so the input form renders without paying for plotly
+    import plotly.express as px
+
+    labels = ["Principal", "Prepayment", "Interest"]
+    sizes = [total_principal, total_prepayment, total_interest]
+    colors = ["#B0C4DE", "#FFB6C1", "#4169E1"]
+    fig_pie = px.pie(
+        names=labels,
+        values=sizes,
+        color_discrete_sequence=colors,
+        title="Car EMI Payment Breakdown",
+    )
+    fig_pie.update_traces(textinfo="percent+label", rotation=140, sort=False)
+
+    return fig_pie
+
+
 ############################
 # Streamlit Car EMI App
 ############################
@@ -221,30 +304,33 @@ def main():
 
         # Build a final DataFrame for the yearly schedule
         df_yearly["TaxesInsuranceMaintenance"] = 0  # For Car EMI, might skip or keep as 0
-        df_yearly["PctLoanPaid"] = 0.0  # optional if you want a % of principal approach
 
         # If you want to compute a % of principal paid:
         #   (Cumulative principal + prepayment) / principal_before_one_time
         # (Be sure to clamp to 100 if balance is 0.)
         initial_car_loan_principal = principal_before_one_time
-        df_yearly["CumulativePP"] = (df_yearly["PrincipalSum"].cumsum() + df_yearly["PrepaymentSum"].cumsum())
+        cumulative_pp = np.cumsum(
+            df_yearly["PrincipalSum"].to_numpy() + df_yearly["PrepaymentSum"].to_numpy()
+        )
         if initial_car_loan_principal > 0:
-            df_yearly["PctLoanPaid"] = ((df_yearly["CumulativePP"] / initial_car_loan_principal) * 100).clip(upper=100)
+            pct_loan_paid = np.minimum(cumulative_pp * (100.0 / initial_car_loan_principal), 100.0)
         else:
-            df_yearly["PctLoanPaid"] = 100
+            pct_loan_paid = np.full_like(cumulative_pp, 100.0)
 
         # Force 100% if the final balance is 0
-        df_yearly.loc[df_yearly["FinalBalance"] <= 0, "PctLoanPaid"] = 100
+        pct_loan_paid[df_yearly["FinalBalance"].to_numpy() <= 0] = 100.0
+        df_yearly["CumulativePP"] = cumulative_pp
+        df_yearly["PctLoanPaid"] = pct_loan_paid
 
         # Build a user-facing DataFrame
         schedule_df = pd.DataFrame({
-            "Year": df_yearly["Year"].astype(int).astype(str),
-            "Principal (₹)": df_yearly["PrincipalSum"].apply(format_inr),
-            "Prepayments (₹)": df_yearly["PrepaymentSum"].apply(format_inr),
-            "Interest (₹)": df_yearly["InterestSum"].apply(format_inr),
-            "Total Payment (₹)": df_yearly["TotalPayment"].apply(format_inr),
-            "Balance (₹)": df_yearly["FinalBalance"].apply(format_inr),
-            "% of Loan Paid": df_yearly["PctLoanPaid"].apply(lambda x: f"{x:.2f}%"),
+            "Year": df_yearly["Year"].astype(str),
+            "Principal (₹)": format_inr_array(df_yearly["PrincipalSum"].to_numpy()),
+            "Prepayments (₹)": format_inr_array(df_yearly["PrepaymentSum"].to_numpy()),
+            "Interest (₹)": format_inr_array(df_yearly["InterestSum"].to_numpy()),
+            "Total Payment (₹)": format_inr_array(df_yearly["TotalPayment"].to_numpy()),
+            "Balance (₹)": format_inr_array(df_yearly["FinalBalance"].to_numpy()),
+            "% of Loan Paid": [f"{pct:.2f}%" for pct in df_yearly["PctLoanPaid"].to_numpy().tolist()],
         })
 
         schedule_df.reset_index(drop=True, inplace=True)
@@ -256,6 +342,8 @@ def main():
         st.write(f"**Insurance / Extra Fees**: {format_inr(insurance_or_fees)}")
         st.write(f"**One-time Prepayment**: {format_inr(one_time_prepay)}")
         st.write(f"**Effective Car Loan Principal**: {format_inr(principal)}")
+        monthly_emi = calculate_car_emi(principal, annual_interest_rate, loan_tenure_years)
+        st.write(f"**Monthly EMI**: {format_inr(monthly_emi)}")
 
         st.write("---")
         st.write(f"**Total Principal Paid**: {format_inr(total_principal)}")
@@ -263,66 +351,35 @@ def main():
         st.write(f"**Total Interest**: {format_inr(total_interest)}")
 
         # Pie Chart
-        fig_pie, ax_pie = plt.subplots(figsize=(5,5))
-        labels = ["Principal", "Prepayment", "Interest"]
-        sizes = [total_principal, total_prepayment, total_interest]
-        colors = ["#B0C4DE", "#FFB6C1", "#4169E1"]
-        ax_pie.pie(sizes, labels=labels, colors=colors, autopct='%1.1f%%', startangle=140)
-        ax_pie.axis("equal")
-        ax_pie.set_title("Car EMI Payment Breakdown")
-        st.pyplot(fig_pie)
-
-        # Bar Chart: Yearly Principal, Interest, Prepayment, plus dotted line for Balance
-        fig_bar, ax_bar = plt.subplots(figsize=(8,5))
-        years_numeric = df_yearly["Year"].astype(int).values
-        principal_list = df_yearly["PrincipalSum"].values
-        interest_list = df_yearly["InterestSum"].values
-        prepay_list = df_yearly["PrepaymentSum"].values
-        balance_list = df_yearly["FinalBalance"].values
-
-        bar_width = 0.6
-        ax_bar.bar(
-            years_numeric,
-            principal_list,
-            color="#B0C4DE",
-            label="Principal",
-            width=bar_width
-        )
-        ax_bar.bar(
-            years_numeric,
-            interest_list,
-            bottom=principal_list,
-            color="#4169E1",
-            label="Interest",
-            width=bar_width
-        )
-        bottom_prepay = principal_list + interest_list
-        ax_bar.bar(
-            years_numeric,
-            prepay_list,
-            bottom=bottom_prepay,
-            color="#FFB6C1",
-            label="Prepayment",
-            width=bar_width
+        # The figure is built once per session; later runs only swap in the totals
+        if "fig_pie" not in st.session_state:
+            st.session_state.fig_pie = build_payment_pie_chart(
+                total_principal, total_prepayment, total_interest
+            )
+        fig_pie = st.session_state.fig_pie
+        fig_pie.update_traces(values=[total_principal, total_prepayment, total_interest])
+        st.plotly_chart(fig_pie)
+
+        # Bar Chart: Yearly Principal, Interest, Prepayment, plus a line for Balance
+        df_chart = pd.DataFrame(
+            df_yearly[["PrincipalSum", "InterestSum", "PrepaymentSum", "FinalBalance"]].to_numpy(),
+            index=df_yearly["Year"].astype(str),
+            columns=["Principal", "Interest", "Prepayment", "Remaining Balance"],
         )
-        # Plot dotted line for final balance
-        ax_bar.plot(
-            years_numeric,
-            balance_list,
-            'k--o',
-            label="Remaining Balance"
+        st.write("### Car Loan Yearly Breakdown")
+        st.bar_chart(
+            df_chart[["Principal", "Interest", "Prepayment"]],
+            color=["#B0C4DE", "#4169E1", "#FFB6C1"],
+            x_label="Year",
+            y_label="Amount (₹)",
         )
-        ax_bar.set_xlabel("Year")
-        ax_bar.set_ylabel("Amount (₹)")
-        ax_bar.set_title("Car Loan Yearly Breakdown")
-        ax_bar.legend()
-
-        ax_bar.yaxis.set_major_formatter(
-            ticker.FuncFormatter(lambda x, pos: f"₹{x:,.0f}")
+        st.line_chart(
+            df_chart[["Remaining Balance"]],
+            color="#000000",
+            x_label="Year",
+            y_label="Amount (₹)",
         )
 
-        st.pyplot(fig_bar)
-
         # Show the Yearly Table
         st.write("## Yearly Payment Schedule")
         st.dataframe(
@@ -345,25 +402,15 @@ def main():
             st.write("## Monthly Amortization Schedule")
             # Convert numeric columns to currency
             df_monthly_display = df_monthly.copy()
-            for c in ["OldBalance","InterestPaid","PrincipalPaid","Prepayment","NewBalance"]:
-                df_monthly_display[c] = df_monthly_display[c].apply(format_inr)
+            currency_cols = ["OldBalance","InterestPaid","PrincipalPaid","Prepayment","NewBalance"]
+            for c, values in zip(currency_cols, df_monthly[currency_cols].to_numpy().T):
+                df_monthly_display[c] = format_inr_array(values)
 
             df_monthly_display.reset_index(drop=True, inplace=True)
 
-            st.dataframe(
-                df_monthly_display.style
-                .set_table_styles([
-                    {
-                        'selector': 'th',
-                        'props': [
-                            ('background-color', '#85C1E9'),
-                            ('color', 'black'),
-                            ('font-weight', 'bold')
-                        ]
-                    },
-                    {'selector': 'td', 'props': [('color', 'black')]},
-                ])
-            )
+            # Plain Arrow-serialized table; st.dataframe ignores Styler
+            # table_styles anyway, so a Styler here only costs per-cell HTML.
+            st.dataframe(df_monthly_display)
         else:
             st.write("**No monthly data** (loan is 0 or ended instantly).")
 